@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Writes saved and added latency of SSE delta coalescing (SSE_COALESCE_MS).
+
+Replays a synthetic token stream at several token rates through the same
+reader-thread + _SSECoalescer path that _stream_chat_completion uses, for a few
+latency windows, and reports downstream writes/sec saved and the latency the
+coalescing added per token.
+
+Usage: python3 misc/bench_coalesce.py [--tokens 150] [--rates 50,200,1000] [--windows 10,20,30]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import proxy_server  # noqa: E402
+
+
+def token_stream(tokens: int, rate: float):
+    gap = 1.0 / rate
+    base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench"}
+    for i in range(tokens):
+        chunk = dict(base, choices=[{"index": 0, "finish_reason": None, "delta": {"content": f" tok{i}"}}])
+        yield "data: " + json.dumps(chunk) + "\n\n"
+        time.sleep(gap)
+    yield "data: " + json.dumps(dict(base, choices=[{"index": 0, "finish_reason": "stop", "delta": {}}])) + "\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def run(tokens: int, rate: float, window_ms: float):
+    coalescer = proxy_server._SSECoalescer(window_ms, proxy_server.SSE_COALESCE_MAX_BYTES)
+    writes = 0
+    for event in proxy_server._iter_with_deadline(token_stream(tokens, rate), coalescer.time_left):
+        if event is not None:
+            coalescer.push(event)
+        if coalescer.drain(force=event is None):
+            writes += 1
+    if coalescer.drain(force=True):
+        writes += 1
+    elapsed = time.monotonic() - coalescer.started
+    events = coalescer.events_in
+    avg_ms = coalescer.delay_total / max(events, 1) * 1000
+    return events, writes, elapsed, avg_ms, coalescer.delay_max * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--tokens", type=int, default=150)
+    ap.add_argument("--rates", default="50,200,1000", help="tokens/sec, comma-separated")
+    ap.add_argument("--windows", default="10,20,30", help="coalescing windows in ms, comma-separated")
+    args = ap.parse_args()
+
+    print(f"{'tok/s':>7}{'window':>8}{'events':>8}{'writes':>8}{'saved/s':>10}{'avg +ms':>9}{'max +ms':>9}")
+    for rate in (float(r) for r in args.rates.split(",")):
+        for window in (float(w) for w in args.windows.split(",")):
+            events, writes, elapsed, avg_ms, max_ms = run(args.tokens, rate, window)
+            saved_per_s = (events - writes) / elapsed
+            print(f"{rate:>7.0f}{window:>8.0f}{events:>8}{writes:>8}{saved_per_s:>10.0f}{avg_ms:>9.1f}{max_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
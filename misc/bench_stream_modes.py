@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Per-event throughput benchmark for the streaming transform pipeline.
+
+Feeds a synthetic llama-server SSE stream (reasoning deltas, then content deltas,
+then a tool call) through _StreamPipeline for every THINKING_MODE and reports
+events/sec and microseconds per event.
+
+Usage: python3 misc/bench_stream_modes.py [--streams 200] [--reasoning 200] [--content 800]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import proxy_server  # noqa: E402
+
+
+def synthetic_stream(reasoning: int, content: int, tool_call: bool):
+    base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench"}
+    events = []
+    for i in range(reasoning):
+        events.append("data: " + json.dumps(dict(base, choices=[{"index": 0, "delta": {"reasoning_content": f" thought{i}"}}])))
+    for i in range(content):
+        events.append("data: " + json.dumps(dict(base, choices=[{"index": 0, "delta": {"content": f" word{i}"}}])))
+    if tool_call:
+        call = {"index": 0, "id": "call_0", "type": "function", "function": {"name": "read_file", "arguments": "{}"}}
+        events.append("data: " + json.dumps(dict(base, choices=[{"index": 0, "delta": {"tool_calls": [call]}}])))
+    events.append("data: " + json.dumps(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])))
+    events.append("data: [DONE]")
+    return events
+
+
+def bench(mode: str, events, streams: int):
+    out_events = 0
+    start = time.perf_counter()
+    for _ in range(streams):
+        pipeline = proxy_server._StreamPipeline(mode)
+        for part in events:
+            out_events += len(pipeline.feed(part))
+        out_events += len(pipeline.finish())
+    elapsed = time.perf_counter() - start
+    return elapsed, out_events
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--streams", type=int, default=200)
+    ap.add_argument("--reasoning", type=int, default=200)
+    ap.add_argument("--content", type=int, default=800)
+    ap.add_argument("--no-tool-call", action="store_true")
+    args = ap.parse_args()
+
+    events = synthetic_stream(args.reasoning, args.content, not args.no_tool_call)
+    total_in = len(events) * args.streams
+    print(f"{args.streams} streams x {len(events)} upstream events = {total_in} events per mode\n")
+    print(f"{'mode':<16}{'events/s':>14}{'us/event':>12}{'out events':>12}")
+    for mode in ("default", "show_reasoning", "events", "both", "off"):
+        elapsed, out_events = bench(mode, events, args.streams)
+        print(f"{mode:<16}{total_in / elapsed:>14,.0f}{elapsed / total_in * 1e6:>12.2f}{out_events:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Streams/sec versus worker count for the proxy's pre-forked serving mode.
+
+Starts a fake llama-server that answers every chat completion with a canned SSE
+stream (reasoning + content deltas), then for each worker count launches
+`proxy_server.py` with WORKERS=<n> and hammers /v1/chat/completions from
+concurrent client processes for a fixed duration.
+
+Usage: python3 misc/bench_workers.py [--workers 1,2,4] [--clients 16] [--duration 10] [--events 300]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+PROXY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "proxy_server.py")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def canned_stream(events: int) -> bytes:
+    base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench"}
+    out = []
+    for i in range(events):
+        key = "reasoning_content" if i < events // 4 else "content"
+        out.append("data: " + json.dumps(dict(base, choices=[{"index": 0, "delta": {key: f" tok{i}"}}])) + "\n\n")
+    out.append("data: [DONE]\n\n")
+    return "".join(out).encode()
+
+
+def run_fake_upstream(port: int, events: int):
+    body = canned_stream(events)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            payload = json.dumps({"data": [{"id": "bench", "created": 0}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    ThreadingHTTPServer.daemon_threads = True
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def client_loop(args):
+    url, deadline = args
+    session = requests.Session()
+    done = 0
+    payload = {"model": "bench", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+    while time.time() < deadline:
+        with session.post(url, json=payload, stream=True) as r:
+            for _ in r.iter_content(chunk_size=65536):
+                pass
+        done += 1
+    return done
+
+
+def bench(workers: int, upstream: str, clients: int, duration: float) -> float:
+    port = free_port()
+    env = dict(
+        os.environ,
+        WORKERS=str(workers),
+        LISTEN_HOST="127.0.0.1",
+        LISTEN_PORT=str(port),
+        UPSTREAM=upstream,
+        WARMUP="off",
+        THINKING_MODE="show_reasoning",
+        VERBOSE="false",
+    )
+    proc = subprocess.Popen([sys.executable, PROXY], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                if requests.get(f"http://127.0.0.1:{port}/api/ready", timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.1)
+        deadline = time.time() + duration
+        with multiprocessing.Pool(clients) as pool:
+            streams = sum(pool.map(client_loop, [(f"http://127.0.0.1:{port}/v1/chat/completions", deadline)] * clients))
+        return streams / duration
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--workers", default="1,2,4")
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--duration", type=float, default=10)
+    ap.add_argument("--events", type=int, default=300, help="SSE events per upstream stream")
+    args = ap.parse_args()
+
+    upstream_port = free_port()
+    upstream = multiprocessing.Process(target=run_fake_upstream, args=(upstream_port, args.events), daemon=True)
+    upstream.start()
+    time.sleep(0.5)
+
+    print(f"{args.clients} clients, {args.events} events/stream, {args.duration:.0f}s per run\n")
+    print(f"{'workers':>8}{'streams/s':>12}{'events/s':>14}")
+    for n in (int(w) for w in args.workers.split(",")):
+        rate = bench(n, f"http://127.0.0.1:{upstream_port}", args.clients, args.duration)
+        print(f"{n:>8}{rate:>12.1f}{rate * (args.events + 1):>14,.0f}")
+    upstream.terminate()
+
+
+if __name__ == "__main__":
+    main()
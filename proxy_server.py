@@ -1,7 +1,14 @@
 import os
+import re
+import codecs
+import math
 import json
 import time
+import queue
+import signal
+import socket
 import threading
+import multiprocessing
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
 
@@ -18,11 +25,65 @@ LISTEN_HOST = os.environ.get("LISTEN_HOST", "0.0.0.0")
 UPSTREAM = os.environ.get("UPSTREAM", "http://10.66.0.7:8080")
 THINKING_MODE = os.environ.get("THINKING_MODE", "default")
 THINKING_DEBUG = os.environ.get("THINKING_DEBUG", "false").lower() in ("1", "true", "yes")
+# Coalesce consecutive SSE content deltas for up to this many ms (0 disables)
+SSE_COALESCE_MAX_MS = 1000.0
+SSE_COALESCE_MS = float(os.environ.get("SSE_COALESCE_MS", "0"))
+if not math.isfinite(SSE_COALESCE_MS):
+    SSE_COALESCE_MS = 0.0
+SSE_COALESCE_MS = min(max(SSE_COALESCE_MS, 0.0), SSE_COALESCE_MAX_MS)
+SSE_COALESCE_MAX_BYTES = int(os.environ.get("SSE_COALESCE_MAX_BYTES", "4096"))
 VERBOSE = os.environ.get("VERBOSE", "false").lower() in ("1", "true", "yes")
 VERSION = "1.0.0"
-active_streams = 0
+# Number of pre-forked worker processes; 1 keeps the single-process threaded server
+WORKERS = int(os.environ.get("WORKERS", "1"))
+# Pre-forked workers rely on inheriting module state, so always use the fork start
+# method (forkserver/spawn would re-import the module and lose the shared objects)
+_mp = multiprocessing.get_context("fork") if hasattr(os, "fork") else multiprocessing
+# In shared memory so pre-forked workers see one counter
+active_streams = _mp.Value("i", 0)
 MODEL_ALIASES: Dict[str, str] = {}
 
+# Relevance-based tool pruning (opt-in). Only the top-K tools most relevant to the
+# latest user/assistant turn are forwarded; the full catalogue is resent if the model
+# calls a tool that was pruned.
+TOOL_PRUNING = os.environ.get("TOOL_PRUNING", "false").lower() in ("1", "true", "yes")
+TOOL_PRUNING_TOP_K = int(os.environ.get("TOOL_PRUNING_TOP_K", "12"))
+TOOL_PRUNING_ALWAYS_KEEP = {
+    n.strip() for n in os.environ.get("TOOL_PRUNING_ALWAYS_KEEP", "").split(",") if n.strip()
+}
+# Embedding model for ranking; empty disables embeddings (keyword scoring only). A
+# llama-server started with --embeddings refuses chat, so this must be a separate
+# embedding model reachable through UPSTREAM (e.g. behind a router such as llama-swap)
+TOOL_PRUNING_EMBED_MODEL = os.environ.get("TOOL_PRUNING_EMBED_MODEL", "")
+TOOL_EMBED_CACHE: Dict[str, List[float]] = {}
+TOOL_EMBED_CACHE_MAX = 4096
+# Per-message cap on the embedded query text; Copilot puts attached file context in
+# the user message, which would otherwise add a large embedding prefill every turn
+TOOL_PRUNING_QUERY_MAX_CHARS = 1500
+_tool_embed_lock = threading.Lock()
+_tool_embed_retry_at = 0.0
+
+# Pooled upstream connections shared by all handlers (keep-alive to llama-server)
+UPSTREAM_POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "16"))
+upstream_session = requests.Session()
+upstream_session.mount(
+    "http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE)
+)
+upstream_session.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE)
+)
+
+# Startup warm-up: "background" (default), "blocking" (wait before serving) or "off"
+WARMUP = os.environ.get("WARMUP", "background").lower()
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "600"))
+WARMUP_RETRY_INTERVAL = float(os.environ.get("WARMUP_RETRY_INTERVAL", "5"))
+WARMUP_CONNECTIONS = int(os.environ.get("WARMUP_CONNECTIONS", "4"))
+WARMUP_PROMPT = os.environ.get("WARMUP_PROMPT", "")
+WARMUP_MAX_TOKENS = int(os.environ.get("WARMUP_MAX_TOKENS", "1"))
+SHOW_CACHE: Dict[str, Dict[str, Any]] = {}
+warmup_state: Dict[str, Any] = {"status": "pending", "steps": {}, "started_at": None, "finished_at": None}
+warmup_done = threading.Event()
+
 
 def estimate_tokens_from_messages(messages: Optional[List[Dict[str, Any]]]) -> int:
     """Rudimentary token estimate used for warnings. Counts approximate tokens by
@@ -87,16 +148,18 @@ def _friendly_model_name(mid: str) -> str:
         return str(mid)
 
 
-def _register_model_alias(alias: str, real_id: str):
+def _register_model_alias(alias: str, real_id: str, table: Optional[Dict[str, str]] = None):
     if not alias or not real_id:
         return
+    if table is None:
+        table = MODEL_ALIASES
     key = alias
     idx = 2
     # Ensure uniqueness if multiple models collapse to the same alias
-    while key in MODEL_ALIASES and MODEL_ALIASES.get(key) != real_id:
+    while key in table and table.get(key) != real_id:
         key = f"{alias} ({idx})"
         idx += 1
-    MODEL_ALIASES[key] = real_id
+    table[key] = real_id
     if VERBOSE:
         print(f"🔗 [ALIASES] {key} -> {real_id}")
 
@@ -113,209 +176,847 @@ def process_queued_show_requests():
         print("[INFO] process_queued_show_requests invoked (no-op)")
 
 
-
-def _stream_chat_completion(upstream_url: str, body: Dict[str, Any]):
-    """Stream chat completions from upstream, injecting reasoning_content
-    into visible content when THINKING_MODE == 'show_reasoning'. This
-    reassembles SSE chunks, parses JSON payloads, and forwards events as
-    SSE to the downstream client.
+# --- Relevance-based tool pruning ---
+
+def _tool_name(tool: Any) -> str:
+    if isinstance(tool, dict):
+        fn = tool.get("function")
+        if isinstance(fn, dict) and isinstance(fn.get("name"), str):
+            return fn["name"]
+        if isinstance(tool.get("name"), str):
+            return tool["name"]
+    return ""
+
+
+def _tool_text(tool: Dict[str, Any]) -> str:
+    fn = tool.get("function") if isinstance(tool.get("function"), dict) else tool
+    desc = fn.get("description") if isinstance(fn.get("description"), str) else ""
+    return f"{_tool_name(tool)}: {desc}"
+
+
+def _message_text(msg: Dict[str, Any]) -> str:
+    content = msg.get("content")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        # Multimodal / multi-part content: keep only the text parts
+        return " ".join(p.get("text", "") for p in content if isinstance(p, dict) and isinstance(p.get("text"), str))
+    return ""
+
+
+def _recent_turn_text(messages: Any, max_chars: Optional[int] = None) -> str:
+    """Text of the latest user message and the latest assistant message, each cut
+    to its last max_chars characters if given (Copilot puts the request last)."""
+    if not isinstance(messages, list):
+        return ""
+    picked: Dict[str, str] = {}
+    for m in reversed(messages):
+        if not isinstance(m, dict):
+            continue
+        role = m.get("role")
+        if role in ("user", "assistant") and role not in picked:
+            text = _message_text(m)
+            if text:
+                picked[role] = text[-max_chars:] if max_chars else text
+        if len(picked) == 2:
+            break
+    return "\n".join(picked[r] for r in ("user", "assistant") if r in picked)
+
+
+def _keyword_tokens(text: str) -> set:
+    # Split camelCase and snake_case so tool names match natural-language words
+    spaced = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    return {t for t in re.split(r"[^a-z0-9]+", spaced.lower()) if len(t) > 2}
+
+
+def _keyword_score(query_tokens: set, tool: Dict[str, Any]) -> float:
+    tool_tokens = _keyword_tokens(_tool_text(tool))
+    if not tool_tokens or not query_tokens:
+        return 0.0
+    return len(tool_tokens & query_tokens) / len(tool_tokens)
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    if na == 0 or nb == 0:
+        return 0.0
+    return dot / (na * nb)
+
+
+def _embed_texts(texts: List[str], model: str) -> Optional[List[List[float]]]:
+    """Embed texts with model through upstream /v1/embeddings, caching vectors per
+    (model, text). Returns None if embeddings are unavailable; callers fall back to
+    keyword scoring.
     """
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "text/event-stream, application/json",
-    }
+    global _tool_embed_retry_at
+    if not model or time.time() < _tool_embed_retry_at:
+        return None
+    prefix = f"{model}\x00"
+    with _tool_embed_lock:
+        missing = [t for t in dict.fromkeys(texts) if prefix + t not in TOOL_EMBED_CACHE]
+    if missing:
+        payload: Dict[str, Any] = {"input": missing, "model": model}
+        try:
+            r = upstream_session.post(f"{UPSTREAM}/v1/embeddings", json=payload, timeout=30)
+            r.raise_for_status()
+            data = r.json().get("data")
+            vectors = [d.get("embedding") for d in sorted(data, key=lambda d: d.get("index", 0))]
+            if len(vectors) != len(missing) or not all(isinstance(v, list) for v in vectors):
+                raise ValueError("unexpected /v1/embeddings response shape")
+        except Exception as e:
+            # Embedding model missing or not loadable; don't hammer the upstream every turn
+            _tool_embed_retry_at = time.time() + 300
+            print(f"⚠️  [TOOLS] Embeddings unavailable, using keyword scoring for 5 minutes: {e}")
+            return None
+        with _tool_embed_lock:
+            if len(TOOL_EMBED_CACHE) + len(missing) > TOOL_EMBED_CACHE_MAX:
+                TOOL_EMBED_CACHE.clear()
+            for t, v in zip(missing, vectors):
+                TOOL_EMBED_CACHE[prefix + t] = v
+    with _tool_embed_lock:
+        try:
+            return [TOOL_EMBED_CACHE[prefix + t] for t in texts]
+        except KeyError:
+            return None
+
+
+def _history_tool_names(body: Dict[str, Any]) -> set:
+    """Tools already called in the conversation or forced via tool_choice."""
+    names = set()
+    for m in body.get("messages") or []:
+        if isinstance(m, dict) and isinstance(m.get("tool_calls"), list):
+            for tc in m["tool_calls"]:
+                names.add(_tool_name(tc))
+    choice = body.get("tool_choice")
+    if isinstance(choice, dict):
+        names.add(_tool_name(choice))
+    names.discard("")
+    return names
+
+
+def _prune_tools(body: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """Forward only the top-K relevant tools plus always-keep tools.
+
+    Ranks tools against the latest user and assistant messages using cosine
+    similarity of cached upstream embeddings blended with keyword overlap. Mutates
+    body["tools"] and returns the full catalogue when pruning happened, else None.
+    """
+    tools = body.get("tools")
+    if not TOOL_PRUNING or not isinstance(tools, list) or len(tools) <= TOOL_PRUNING_TOP_K:
+        return None
+    query = _recent_turn_text(body.get("messages"))
+    if not query:
+        return None
+
+    keep = TOOL_PRUNING_ALWAYS_KEEP | _history_tool_names(body)
+    query_tokens = _keyword_tokens(query)
+    scores = [_keyword_score(query_tokens, t) if isinstance(t, dict) else 0.0 for t in tools]
+    vectors = None
+    if TOOL_PRUNING_EMBED_MODEL:
+        embed_query = _recent_turn_text(body.get("messages"), TOOL_PRUNING_QUERY_MAX_CHARS)
+        vectors = _embed_texts(
+            [embed_query] + [_tool_text(t) if isinstance(t, dict) else "" for t in tools], TOOL_PRUNING_EMBED_MODEL
+        )
+    if vectors:
+        qv = vectors[0]
+        scores = [0.7 * _cosine(qv, tv) + 0.3 * ks for tv, ks in zip(vectors[1:], scores)]
+
+    ranked = sorted(range(len(tools)), key=lambda i: scores[i], reverse=True)
+    selected = {i for i in ranked[:TOOL_PRUNING_TOP_K]}
+    selected.update(i for i, t in enumerate(tools) if _tool_name(t) in keep)
+    if len(selected) == len(tools):
+        return None
+
+    pruned = [t for i, t in enumerate(tools) if i in selected]  # preserve original order
+    body["tools"] = pruned
+    # Savings are logged once the response is known not to need a full-catalogue resend
+    print(
+        f"✂️  [TOOLS] Pruned {len(tools)} -> {len(pruned)} tools "
+        f"({'embeddings+keywords' if vectors else 'keywords'})"
+    )
+    vlog("[TOOLS] Forwarded tools:", [_tool_name(t) for t in pruned])
+    return tools
+
+
+def _tools_tokens(tools: Optional[List[Dict[str, Any]]]) -> int:
+    # Same chars/4 heuristic as estimate_tokens_from_messages
+    return len(json.dumps(tools)) // 4 if tools else 0
+
+
+def _log_pruning_outcome(body: Dict[str, Any], full_tools: Optional[List[Dict[str, Any]]], resent: bool) -> None:
+    if not full_tools:
+        return
+    if resent:
+        # The pruned attempt's whole prompt was wasted prefill
+        lost = estimate_tokens_from_messages(body.get("messages")) + _tools_tokens(body.get("tools"))
+        print(f"🔁 [TOOLS] Model called a pruned tool; resending with all {len(full_tools)} tools (net loss: ~{lost} prompt tokens)")
+    else:
+        saved = _tools_tokens(full_tools) - _tools_tokens(body.get("tools"))
+        print(f"✂️  [TOOLS] ~{saved} prompt tokens saved by tool pruning")
+
+
+def _called_pruned_tool(tool_names: List[str], body: Dict[str, Any], full_tools: Optional[List[Dict[str, Any]]]) -> bool:
+    """True if the model called a tool that exists in the full catalogue but was pruned."""
+    if not full_tools:
+        return False
+    forwarded = {_tool_name(t) for t in body.get("tools") or []}
+    known = {_tool_name(t) for t in full_tools}
+    return any(n in known and n not in forwarded for n in tool_names)
+
+
+def _tool_call_names(obj: Any) -> List[str]:
+    """Collect function names from tool_calls in a chat completion (chunk) object."""
+    names: List[str] = []
+    choices = obj.get("choices") if isinstance(obj, dict) else None
+    for ch in choices if isinstance(choices, list) else []:
+        part = (ch.get("delta") or ch.get("message")) if isinstance(ch, dict) else None
+        if isinstance(part, dict) and isinstance(part.get("tool_calls"), list):
+            names.extend(n for n in (_tool_name(tc) for tc in part["tool_calls"]) if n)
+    return names
+
+
+def _sse_tool_call_names(events: List[str]) -> List[str]:
+    """Collect function names from buffered SSE tool-call events."""
+    names: List[str] = []
+    for ev in events:
+        for line in ev.splitlines():
+            if not line.startswith("data:"):
+                continue
+            try:
+                names.extend(_tool_call_names(json.loads(line[len("data:"):].strip())))
+            except Exception:
+                continue
+    return names
 
-    with requests.post(upstream_url, data=json.dumps(body), headers=headers, stream=True) as r:
-        content_type = r.headers.get("content-type", "")
-        vlog(f"[POST] Upstream response status: {r.status_code}")
-        vlog(f"[POST] Upstream response headers: {dict(r.headers)}")
 
-        # Initial heartbeats
-        yield ": heartbeat\n\n"
-        yield ": processing-prompt\n\n"
+# --- Streaming transform pipeline ---
+#
+# Each chat stream gets a _StreamPipeline built for its thinking mode. Upstream SSE
+# events are fed through per-stream stages that rewrite parsed chunks in place and
+# may emit extra SSE events; tool-call events are held back by _ToolCallStage.
 
-        is_streaming = "text/event-stream" in content_type
+THINKING_MODES = ("default", "vscode", "show_reasoning", "content", "events", "both", "off")
+REASONING_SEP = "\n\n---\n\n"
 
-        tool_call_buffer: List[str] = []
-        is_tool_call = False
-        tool_call_detected = False
-        done_received = False
-        reasoning_prefix_emitted = False
-        reasoning_pending_separator = False
-        seen_reasoning = False
-        pre_reasoning_content_buffer = ""
 
-        if is_streaming:
-            buffer = ""
-            for chunk in r.iter_content(chunk_size=1024):
-                if not chunk:
-                    continue
-                s = chunk.decode("utf-8", errors="ignore")
-                buffer += s
+def _sse_data(obj: Any) -> str:
+    return "data: " + json.dumps(obj, separators=(",", ":"), ensure_ascii=False) + "\n\n"
 
-                parts = buffer.split("\n\n")
-                buffer = parts.pop() if parts else ""
 
-                for part in parts:
-                    if not part.strip():
-                        continue
+def _sse_event(name: str, obj: Any) -> str:
+    return f"event: {name}\n" + _sse_data(obj)
 
-                    event_raw = part + "\n\n"
-
-                    data_lines: List[str] = []
-                    for line in part.splitlines():
-                        if line.startswith("data:"):
-                            data_lines.append(line[len("data:"):].lstrip())
-                    if not data_lines:
-                        if is_tool_call:
-                            tool_call_buffer.append(event_raw)
-                        else:
-                            yield event_raw
-                        continue
 
-                    event_payload = "\n".join(data_lines)
+def _pop_reasoning(choices: List[Any], keep: bool) -> List[str]:
+    """Collect reasoning_content from deltas/messages, removing it unless keep."""
+    found: List[str] = []
+    for choice in choices:
+        if not isinstance(choice, dict):
+            continue
+        for key in ("delta", "message"):
+            part = choice.get(key)
+            if isinstance(part, dict) and isinstance(part.get("reasoning_content"), str):
+                rc = part["reasoning_content"] if keep else part.pop("reasoning_content")
+                if rc:
+                    found.append(rc)
+    return found
 
-                    if event_payload.strip() == "[DONE]":
-                        done_received = True
-                        if is_tool_call:
-                            tool_call_buffer.append("data: [DONE]\n\n")
-                        else:
-                            yield "data: [DONE]\n\n"
-                        continue
 
-                    if ("tool_call" in event_payload) or ("tool_calls" in event_payload):
-                        is_tool_call = True
-                        tool_call_detected = True
-                        tool_call_buffer.append(event_raw)
-                        continue
+def _only_empty_deltas(choices: List[Any]) -> bool:
+    # A chunk whose deltas are all empty and carry no finish_reason is safe to drop
+    return all(
+        isinstance(c, dict) and c.get("delta") == {} and c.get("finish_reason") is None and "message" not in c
+        for c in choices
+    )
 
-                    try:
-                        obj = json.loads(event_payload)
-                    except Exception:
-                        if is_tool_call:
-                            tool_call_buffer.append(event_raw)
-                        else:
-                            yield event_raw
-                        continue
 
-                    if THINKING_MODE == "show_reasoning":
-                        try:
-                            choices = obj.get("choices") if isinstance(obj, dict) else None
-                            if isinstance(choices, list) and len(choices) > 0:
-                                SEP = "\n\n---\n\n"
-                                # Snapshot whether each choice.delta had upstream 'content' BEFORE modifications
-                                had_original_delta_content = []
-                                for choice in choices:
-                                    if isinstance(choice, dict) and isinstance(choice.get("delta"), dict):
-                                        up_cont = choice["delta"].get("content")
-                                        had_original_delta_content.append(isinstance(up_cont, str) and len(up_cont) > 0)
-                                    else:
-                                        had_original_delta_content.append(False)
-                                for choice in choices:
-                                    if not isinstance(choice, dict):
-                                        continue
-
-                                    if choice.get("message") and isinstance(choice.get("message"), dict):
-                                        msg = choice["message"]
-                                        if isinstance(msg.get("reasoning_content"), str):
-                                            rc = msg.pop("reasoning_content")
-                                            rc = rc.replace("\r\n", "\n")
-                                            original = msg.get("content") or ""
-                                            seen_reasoning = True
-                                            if pre_reasoning_content_buffer or original:
-                                                # If we buffered content before reasoning or have original alongside, flush buffer after HR
-                                                combined = "💭 " + rc + SEP + (pre_reasoning_content_buffer if pre_reasoning_content_buffer else "")
-                                                if original:
-                                                    combined += original
-                                                msg["content"] = combined
-                                                pre_reasoning_content_buffer = ""
-                                                reasoning_pending_separator = False
-                                            else:
-                                                # Emit reasoning now, and mark that the next normal content
-                                                # should be prefixed with a visible separator.
-                                                msg["content"] = "💭 " + rc
-                                                reasoning_pending_separator = True
-
-                                    if choice.get("delta") and isinstance(choice.get("delta"), dict):
-                                        d = choice["delta"]
-                                        if isinstance(d.get("reasoning_content"), str):
-                                            rc = d.pop("reasoning_content")
-                                            rc = rc.replace("\r\n", "\n")
-                                            original = d.get("content") or ""
-                                            seen_reasoning = True
-                                            if not reasoning_prefix_emitted:
-                                                if pre_reasoning_content_buffer or original:
-                                                    # Flush any buffered pre-reasoning content, plus any original content, after HR
-                                                    combined_tail = (pre_reasoning_content_buffer if pre_reasoning_content_buffer else "")
-                                                    if original:
-                                                        combined_tail += original
-                                                    d["content"] = "💭 " + rc + SEP + combined_tail
-                                                    pre_reasoning_content_buffer = ""
-                                                    reasoning_pending_separator = False
-                                                else:
-                                                    # Start reasoning block; next normal content gets prefixed with SEP.
-                                                    d["content"] = "💭 " + rc
-                                                    reasoning_pending_separator = True
-                                                reasoning_prefix_emitted = True
-                                            else:
-                                                if original:
-                                                    d["content"] = _join_with_space(rc, original)
-                                                else:
-                                                    d["content"] = rc
-                                        else:
-                                            # No reasoning in this delta; if we haven't seen reasoning yet, buffer content
-                                            cont_piece = d.get("content")
-                                            if isinstance(cont_piece, str) and cont_piece and not seen_reasoning:
-                                                pre_reasoning_content_buffer += cont_piece
-                                                # Remove content from this event so we can emit it later in order
-                                                d["content"] = ""
-
-                                if reasoning_pending_separator and isinstance(obj, dict):
-                                    try:
-                                        for idx, ch in enumerate(obj.get("choices", [])):
-                                            if not isinstance(ch, dict):
-                                                continue
-                                            if ch.get("delta") and isinstance(ch.get("delta"), dict):
-                                                delta_obj = ch["delta"]
-                                                cont = delta_obj.get("content")
-                                                # Only inject separator when upstream originally provided content in this delta
-                                                if had_original_delta_content[idx] and isinstance(cont, str) and cont:
-                                                    # Prefix the first visible content with a Markdown HR separator
-                                                    if not cont.startswith("\n---\n") and not cont.startswith("---\n"):
-                                                        delta_obj["content"] = SEP + cont
-                                                    reasoning_pending_separator = False
-                                                    break
-                                    except Exception:
-                                        pass
-                        except Exception:
-                            pass
-
-                    try:
-                        out_payload = json.dumps(obj)
-                    except Exception:
-                        out_payload = event_payload
-
-                    out_event = f"data: {out_payload}\n\n"
-                    if is_tool_call:
-                        tool_call_buffer.append(out_event)
+class _ReasoningFoldStage:
+    """show_reasoning: fold reasoning_content into visible content.
+
+    Reasoning is prefixed with 💭 and separated from the answer by a Markdown HR.
+    Content that arrives before any reasoning is held back and emitted after it.
+    """
+
+    __slots__ = ("prefix_emitted", "pending_separator", "seen_reasoning", "pre_parts")
+
+    def __init__(self):
+        self.prefix_emitted = False
+        self.pending_separator = False
+        self.seen_reasoning = False
+        self.pre_parts: List[str] = []
+
+    def needs(self, payload: str) -> bool:
+        return not self.seen_reasoning or self.pending_separator or "reasoning_content" in payload
+
+    def on_chunk(self, obj: Dict[str, Any], emit: List[str]) -> bool:
+        choices = obj.get("choices")
+        if not isinstance(choices, list) or not choices:
+            return True
+        # Snapshot whether each choice.delta had upstream 'content' BEFORE modifications
+        had_original_delta_content = [
+            isinstance(c, dict) and isinstance(c.get("delta"), dict)
+            and isinstance(c["delta"].get("content"), str) and len(c["delta"]["content"]) > 0
+            for c in choices
+        ]
+        for choice in choices:
+            if not isinstance(choice, dict):
+                continue
+
+            msg = choice.get("message")
+            # Only fold non-empty reasoning into a full message; an empty field is left as-is
+            if isinstance(msg, dict) and isinstance(msg.get("reasoning_content"), str) and msg["reasoning_content"]:
+                rc = msg.pop("reasoning_content").replace("\r\n", "\n")
+                original = msg.get("content") or ""
+                self.seen_reasoning = True
+                if self.pre_parts or original:
+                    # Flush content buffered before reasoning (and any original content) after the HR
+                    msg["content"] = "".join(("💭 ", rc, REASONING_SEP, *self.pre_parts, original))
+                    self.pre_parts.clear()
+                    self.pending_separator = False
+                else:
+                    # Emit reasoning now; the next normal content gets a visible separator
+                    msg["content"] = "💭 " + rc
+                    self.pending_separator = True
+
+            d = choice.get("delta")
+            if not d or not isinstance(d, dict):
+                continue
+            if isinstance(d.get("reasoning_content"), str):
+                rc = d.pop("reasoning_content").replace("\r\n", "\n")
+                original = d.get("content") or ""
+                self.seen_reasoning = True
+                if not self.prefix_emitted:
+                    if self.pre_parts or original:
+                        d["content"] = "".join(("💭 ", rc, REASONING_SEP, *self.pre_parts, original))
+                        self.pre_parts.clear()
+                        self.pending_separator = False
                     else:
-                        yield out_event
+                        # Start reasoning block; next normal content gets prefixed with the HR
+                        d["content"] = "💭 " + rc
+                        self.pending_separator = True
+                    self.prefix_emitted = True
+                else:
+                    d["content"] = _join_with_space(rc, original) if original else rc
+            else:
+                # No reasoning in this delta; until reasoning shows up, hold content back
+                cont_piece = d.get("content")
+                if isinstance(cont_piece, str) and cont_piece and not self.seen_reasoning:
+                    self.pre_parts.append(cont_piece)
+                    d["content"] = ""
+
+        if self.pending_separator:
+            for idx, ch in enumerate(choices):
+                if not isinstance(ch, dict) or not isinstance(ch.get("delta"), dict):
+                    continue
+                cont = ch["delta"].get("content")
+                # Only inject the separator when upstream originally provided content in this delta
+                if had_original_delta_content[idx] and isinstance(cont, str) and cont:
+                    if not cont.startswith("\n---\n") and not cont.startswith("---\n"):
+                        ch["delta"]["content"] = REASONING_SEP + cont
+                    self.pending_separator = False
+                    break
+        return True
+
+    def on_end(self, emit: List[str]) -> None:
+        # No reasoning ever appeared: flush the held-back content before [DONE]
+        if not self.seen_reasoning and self.pre_parts:
+            emit.append(_sse_data({"choices": [{"delta": {"content": "".join(self.pre_parts)}}]}))
+            self.pre_parts.clear()
+
+
+class _ThinkingEventStage:
+    """events/both: mirror reasoning_content as custom `event: thinking` SSE events.
+
+    With keep_reasoning (both) the standard reasoning_content field is left in place.
+    """
+
+    __slots__ = ("keep_reasoning",)
+
+    def __init__(self, keep_reasoning: bool):
+        self.keep_reasoning = keep_reasoning
+
+    def needs(self, payload: str) -> bool:
+        return "reasoning_content" in payload
+
+    def on_chunk(self, obj: Dict[str, Any], emit: List[str]) -> bool:
+        choices = obj.get("choices")
+        if not isinstance(choices, list):
+            return True
+        for rc in _pop_reasoning(choices, self.keep_reasoning):
+            emit.append(_sse_event("thinking", {"content": rc}))
+        return self.keep_reasoning or not _only_empty_deltas(choices)
+
+    def on_end(self, emit: List[str]) -> None:
+        pass
+
+
+class _ReasoningStripStage:
+    """off: drop reasoning_content entirely."""
+
+    __slots__ = ()
+
+    def needs(self, payload: str) -> bool:
+        return "reasoning_content" in payload
+
+    def on_chunk(self, obj: Dict[str, Any], emit: List[str]) -> bool:
+        choices = obj.get("choices")
+        if not isinstance(choices, list):
+            return True
+        return not (_pop_reasoning(choices, False) and _only_empty_deltas(choices))
+
+    def on_end(self, emit: List[str]) -> None:
+        pass
+
+
+class _ToolCallStage:
+    """Hold back everything from the first tool-call event until the stream ends,
+    so the tool call reaches the client in one piece (and can be retried)."""
+
+    __slots__ = ("active", "buffer")
+
+    def __init__(self):
+        self.active = False
+        self.buffer: List[str] = []
+
+    def detect(self, payload: str) -> bool:
+        if not self.active and "tool_call" in payload:  # matches tool_call and tool_calls
+            self.active = True
+        return self.active
+
+    def route(self, events: List[str]) -> List[str]:
+        if self.active:
+            self.buffer.extend(events)
+            return []
+        return events
+
+
+class _ResendPrefixStage:
+    """Record the text fed to the client so far and, after a pruned-tool
+    resend, drop that same prefix from the new upstream stream so the client
+    sees one continuous answer."""
+
+    __slots__ = ("sent", "skip", "recording")
+
+    def __init__(self):
+        self.sent: Dict[str, List[str]] = {"reasoning_content": [], "content": []}
+        self.skip: Dict[str, str] = {}
+        self.recording = True
+
+    def needs(self, payload: str) -> bool:
+        return "content" in payload  # matches content and reasoning_content
+
+    def resume(self) -> None:
+        """Switch from recording to skipping the recorded prefix."""
+        self.skip = {k: "".join(v) for k, v in self.sent.items() if v}
+        self.recording = False
+
+    def on_chunk(self, obj: Dict[str, Any], emit: List[str]) -> bool:
+        choices = obj.get("choices")
+        if not isinstance(choices, list) or len(choices) != 1 or not isinstance(choices[0], dict):
+            return True
+        delta = choices[0].get("delta")
+        if not isinstance(delta, dict):
+            return True
+        trimmed = False
+        for key in ("reasoning_content", "content"):
+            text = delta.get(key)
+            if not isinstance(text, str) or not text:
+                continue
+            if self.recording:
+                self.sent[key].append(text)
+                continue
+            pending = self.skip.get(key)
+            if not pending:
+                continue
+            n = 0
+            limit = min(len(text), len(pending))
+            while n < limit and text[n] == pending[n]:
+                n += 1
+            if n == len(text):
+                self.skip[key] = pending[n:]
+                del delta[key]
+                trimmed = True
+                continue
+            if n < len(pending):
+                print(f"⚠️  [TOOLS] Resent answer diverged from the text already streamed ({len(pending) - n} chars differ)")
+            self.skip[key] = ""
+            delta[key] = text[n:]
+        return not trimmed or bool(delta) or choices[0].get("finish_reason") is not None
+
+    def on_end(self, emit: List[str]) -> None:
+        pass
+
 
-            if tool_call_detected:
-                yield "".join(tool_call_buffer)
-            # If no reasoning ever appeared but we buffered content, flush it before [DONE]
-            if (not seen_reasoning) and pre_reasoning_content_buffer:
+def _build_stream_stages(mode: str) -> List[Any]:
+    if mode in ("show_reasoning", "content"):
+        return [_ReasoningFoldStage()]
+    if mode == "events":
+        return [_ThinkingEventStage(keep_reasoning=False)]
+    if mode == "both":
+        return [_ThinkingEventStage(keep_reasoning=True)]
+    if mode == "off":
+        return [_ReasoningStripStage()]
+    return []  # default / vscode: pass reasoning_content through untouched
+
+
+class _StreamPipeline:
+    """Per-stream SSE rewriter: feed() one upstream event, finish() at end of stream."""
+
+    __slots__ = ("stages", "tools", "prefix")
+
+    def __init__(self, mode: str, resendable: bool = False):
+        self.stages = _build_stream_stages(mode)
+        self.tools = _ToolCallStage()
+        # Only needed when a pruned-tool resend may continue this stream
+        self.prefix = _ResendPrefixStage() if resendable else None
+        if self.prefix is not None:
+            self.stages.insert(0, self.prefix)
+
+    def resume(self) -> None:
+        """Continue this pipeline on a resent stream: drop the abandoned tool
+        call and skip the text the client has already received."""
+        self.tools = _ToolCallStage()
+        if self.prefix is not None:
+            self.prefix.resume()
+
+    def feed(self, part: str) -> List[str]:
+        """Transform one SSE event (without its trailing blank line)."""
+        data_lines = [line[5:].lstrip() for line in part.splitlines() if line.startswith("data:")]
+        if not data_lines:
+            return self.tools.route([part + "\n\n"])
+        payload = data_lines[0] if len(data_lines) == 1 else "\n".join(data_lines)
+
+        if payload.strip() == "[DONE]":
+            return []  # emitted by finish(), after any held-back content
+        if "tool_call" in payload and self.tools.detect(payload):
+            if self.prefix is not None:
+                self.prefix.recording = False  # later text is buffered, not streamed
+            return self.tools.route([part + "\n\n"])
+
+        out: List[str] = []
+        obj = None
+        keep = True
+        for stage in self.stages:
+            if not stage.needs(payload):
+                continue
+            if obj is None:
                 try:
-                    flush_obj = {
-                        "choices": [
-                            {"delta": {"content": pre_reasoning_content_buffer}}
-                        ]
-                    }
-                    yield f"data: {json.dumps(flush_obj)}\n\n"
+                    obj = json.loads(payload)
                 except Exception:
-                    pass
-            if not done_received:
-                yield "data: [DONE]\n\n"
+                    break
+                if not isinstance(obj, dict):
+                    obj = None
+                    break
+            keep = stage.on_chunk(obj, out) and keep
+        if obj is None:
+            out.append(part + "\n\n")  # untouched: forward upstream bytes as-is
+        elif keep:
+            out.append(_sse_data(obj))
+        return self.tools.route(out)
+
+    def finish(self) -> List[str]:
+        out: List[str] = []
+        for stage in self.stages:
+            stage.on_end(out)
+        out.extend(self.tools.buffer)
+        out.append("data: [DONE]\n\n")
+        return out
+
+
+class _SSECoalescer:
+    """Merge consecutive single-choice content (or reasoning_content) deltas into
+    one SSE event, flushed when the latency window or size cap is reached.
+
+    The first delta, a delta arriving after a quiet period longer than the
+    window (slow streams gain nothing from waiting), and anything that is not a
+    plain delta (tool calls, finish chunks, thinking events, comments, [DONE])
+    are never held back: pending deltas are flushed in front of them and both
+    go out in the same write.
+    """
+
+    __slots__ = (
+        "window", "max_bytes", "template", "key", "parts", "arrivals", "size",
+        "ready", "first_sent", "last_arrival", "events_in", "writes_out", "delay_total", "delay_max", "started",
+    )
+
+    def __init__(self, window_ms: float, max_bytes: int):
+        self.window = window_ms / 1000.0
+        self.max_bytes = max_bytes
+        self.template: Optional[Dict[str, Any]] = None
+        self.key = ""
+        self.parts: List[str] = []
+        self.arrivals: List[float] = []
+        self.size = 0
+        self.ready: List[str] = []
+        self.first_sent = False
+        self.last_arrival = 0.0
+        self.events_in = 0
+        self.writes_out = 0
+        self.delay_total = 0.0
+        self.delay_max = 0.0
+        self.started = time.monotonic()
+
+    @staticmethod
+    def _plain_delta(event: str):
+        """(obj, key, text) if event is a mergeable single-choice delta, else None."""
+        if not event.startswith("data:") or "tool_call" in event or event.count("\n") != 2:
+            return None
+        try:
+            obj = json.loads(event[5:])
+        except Exception:
+            return None
+        choices = obj.get("choices") if isinstance(obj, dict) else None
+        if not isinstance(choices, list) or len(choices) != 1 or not isinstance(choices[0], dict):
+            return None
+        ch = choices[0]
+        delta = ch.get("delta")
+        if ch.get("finish_reason") is not None or not isinstance(delta, dict) or len(delta) != 1:
+            return None
+        key, text = next(iter(delta.items()))
+        if key not in ("content", "reasoning_content") or not isinstance(text, str):
+            return None
+        return obj, key, text
+
+    def push(self, event: str) -> None:
+        self.events_in += 1
+        now = time.monotonic()
+        plain = self._plain_delta(event)
+        idle = not self.parts and now - self.last_arrival >= self.window
+        if plain is not None:
+            self.last_arrival = now
+        if plain is None or not self.first_sent or idle:
+            if plain is not None and plain[2]:
+                self.first_sent = True  # the first token goes out immediately
+            self._flush()
+            self.ready.append(event)
+            return
+        obj, key, text = plain
+        if self.parts and (key != self.key or obj["choices"][0].get("index") != self.template["choices"][0].get("index")):
+            self._flush()
+        if not self.parts:
+            self.template, self.key = obj, key
+        self.parts.append(text)
+        self.arrivals.append(now)
+        self.size += len(text)
+        if self.size >= self.max_bytes:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self.parts:
+            return
+        now = time.monotonic()
+        for t in self.arrivals:
+            self.delay_total += now - t
+        self.delay_max = max(self.delay_max, now - self.arrivals[0])
+        self.template["choices"][0]["delta"][self.key] = "".join(self.parts)
+        self.ready.append(_sse_data(self.template))
+        self.template = None
+        self.parts = []
+        self.arrivals = []
+        self.size = 0
+
+    def time_left(self) -> Optional[float]:
+        """Seconds until pending deltas are due, or None if nothing is pending."""
+        if not self.parts:
+            return None
+        return max(0.0, self.arrivals[0] + self.window - time.monotonic())
+
+    def drain(self, force: bool = False) -> str:
+        """Everything ready to write, as one string (flushing pending deltas if due)."""
+        if self.parts and (force or self.time_left() == 0.0):
+            self._flush()
+        if not self.ready:
+            return ""
+        out = "".join(self.ready)
+        self.ready = []
+        self.writes_out += 1
+        return out
+
+    def report(self) -> None:
+        saved = self.events_in - self.writes_out
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        avg_ms = self.delay_total / max(self.events_in, 1) * 1000
+        print(
+            f"🧵 [COALESCE] {self.events_in} events -> {self.writes_out} writes "
+            f"({saved} saved, {saved / elapsed:.0f} writes/s); "
+            f"added latency avg {avg_ms:.1f}ms, max {self.delay_max * 1000:.1f}ms"
+        )
+
+
+def _iter_with_deadline(chunks, time_left):
+    """Iterate upstream chunks on a reader thread, yielding None whenever
+    time_left() elapses with no data so pending deltas can be flushed."""
+    q: "queue.Queue[Any]" = queue.Queue()
+    end = object()
+
+    def _reader():
+        try:
+            for chunk in chunks:
+                q.put(chunk)
+        except Exception as e:  # surfaced to the consumer; also raised when the stream is closed
+            q.put(e)
+        finally:
+            q.put(end)
+
+    threading.Thread(target=_reader, name="sse-reader", daemon=True).start()
+    while True:
+        try:
+            item = q.get(timeout=time_left())
+        except queue.Empty:
+            yield None
+            continue
+        if item is end:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def _resolve_coalesce_ms(requested: Optional[str]) -> float:
+    """Per-request coalescing window (X-SSE-Coalesce-Ms header), else SSE_COALESCE_MS.
+    Clamped to SSE_COALESCE_MAX_MS so the window stays latency-bounded."""
+    if requested:
+        try:
+            ms = float(requested)
+            if not math.isfinite(ms):
+                raise ValueError("not finite")
+            return min(max(ms, 0.0), SSE_COALESCE_MAX_MS)
+        except ValueError:
+            vlog(f"[COALESCE] Ignoring invalid X-SSE-Coalesce-Ms '{requested}'")
+    return SSE_COALESCE_MS
+
+
+def _resolve_thinking_mode(requested: Optional[str]) -> str:
+    """Per-request thinking mode (X-Thinking-Mode header), else THINKING_MODE."""
+    mode = (requested or "").strip().lower()
+    if mode in THINKING_MODES:
+        return mode
+    if mode:
+        vlog(f"[THINKING] Ignoring unknown X-Thinking-Mode '{mode}', using '{THINKING_MODE}'")
+    return THINKING_MODE
+
+
+def _read_available(resp, chunk_size: int, decode_content: bool):
+    """Yield response bytes as soon as any are readable, up to chunk_size per read.
+    Unlike iter_content(), a read never waits for a full chunk_size of data."""
+    read1 = getattr(resp.raw, "read1", None)
+    if read1 is None:
+        # urllib3 < 2 (requirements.txt pins >= 2): stream() waits for a full read, so
+        # keep reads small to avoid holding back tokens on non-chunked responses
+        yield from resp.raw.stream(min(chunk_size, 1024), decode_content=decode_content)
+        return
+    while True:
+        chunk = read1(chunk_size, decode_content=decode_content)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _stream_chat_completion(
+    upstream_url: str,
+    body: Dict[str, Any],
+    full_tools: Optional[List[Dict[str, Any]]] = None,
+    mode: Optional[str] = None,
+    coalesce_ms: Optional[float] = None,
+    is_retry: bool = False,
+    pipeline: Optional[_StreamPipeline] = None,
+):
+    """Stream chat completions from upstream, rewriting reasoning_content
+    according to the thinking mode (see _build_stream_stages). This
+    reassembles SSE chunks, runs each event through a _StreamPipeline, and
+    forwards events as SSE to the downstream client, optionally merging
+    content deltas within coalesce_ms (see _SSECoalescer).
+
+    When tools were pruned (full_tools given), text streams as usual while
+    _ToolCallStage buffers the tool call. If the model called a pruned tool,
+    the upstream stream is abandoned and the request is resent with the full
+    set; the resend continues the same pipeline, which drops the text the
+    client already received (see _ResendPrefixStage).
+    """
+    mode = mode or THINKING_MODE
+    coalesce_ms = SSE_COALESCE_MS if coalesce_ms is None else coalesce_ms
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream, application/json",
+    }
+
+    retry_body: Optional[Dict[str, Any]] = None
+    with upstream_session.post(upstream_url, data=json.dumps(body), headers=headers, stream=True) as r:
+        content_type = r.headers.get("content-type", "")
+        vlog(f"[POST] Upstream response status: {r.status_code}")
+        vlog(f"[POST] Upstream response headers: {dict(r.headers)}")
+
+        if not is_retry:
+            # Initial heartbeats
+            yield ": heartbeat\n\n"
+            yield ": processing-prompt\n\n"
+
+        if "text/event-stream" in content_type:
+            if pipeline is None:
+                pipeline = _StreamPipeline(mode, resendable=bool(full_tools))
+            coalescer = _SSECoalescer(coalesce_ms, SSE_COALESCE_MAX_BYTES) if coalesce_ms > 0 else None
+            # Whether the first tool call's name has been checked against the pruned set
+            checked = not full_tools
+
+            def _route(events: List[str]) -> List[str]:
+                if coalescer is None or not events:
+                    return events
+                for event in events:
+                    coalescer.push(event)
+                out = coalescer.drain()
+                return [out] if out else []
+
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")  # keeps split multi-byte chars
+            buffer = ""
+            chunks = _read_available(r, 65536, decode_content=True)
+            if coalescer is not None:
+                chunks = _iter_with_deadline(chunks, coalescer.time_left)
+            for chunk in chunks:
+                if chunk is None:
+                    # Latency window elapsed with no upstream data
+                    out = coalescer.drain(force=True)
+                    if out:
+                        yield out
+                    continue
+                if not chunk:
+                    continue
+                buffer += decoder.decode(chunk)
+                if "\n\n" not in buffer:
+                    continue
+                parts = buffer.split("\n\n")
+                buffer = parts.pop()
+                events: List[str] = []
+                for part in parts:
+                    if part.strip():
+                        events.extend(pipeline.feed(part))
+                yield from _route(events)
+                if not checked and pipeline.tools.active:
+                    names = _sse_tool_call_names(pipeline.tools.buffer)
+                    if not names:
+                        continue
+                    checked = True
+                    if _called_pruned_tool(names, body, full_tools):
+                        retry_body = dict(body, tools=full_tools)
+                        break
+
+            if not checked and _called_pruned_tool(_sse_tool_call_names(pipeline.tools.buffer), body, full_tools):
+                retry_body = dict(body, tools=full_tools)
+
+            if retry_body is None:
+                if full_tools and _called_pruned_tool(_sse_tool_call_names(pipeline.tools.buffer), body, full_tools):
+                    # A later parallel call hit a pruned tool; the client knows the full
+                    # catalogue, so forward it rather than resend for a secondary call
+                    print("⚠️  [TOOLS] Parallel tool call uses a pruned tool; forwarding as-is")
+                yield from _route(pipeline.finish())
+                _log_pruning_outcome(body, full_tools, resent=False)
+            # Also on the resend path: flush pending deltas and keep this stream's stats
+            if coalescer is not None:
+                out = coalescer.drain(force=True)
+                if out:
+                    yield out
+                coalescer.report()
         else:
             raw = r.content
             try:
@@ -323,52 +1024,51 @@ def _stream_chat_completion(upstream_url: str, body: Dict[str, Any]):
             except Exception:
                 data = raw.decode("utf-8", errors="ignore")
 
-            if (
-                isinstance(data, dict)
-                and data.get("choices")
-                and data["choices"][0].get("message")
-                and data["choices"][0]["message"].get("reasoning_content")
-            ):
-                reasoning_content = data["choices"][0]["message"]["reasoning_content"]
-                if THINKING_MODE == "show_reasoning":
-                    modified = dict(data)
-                    msg = dict(modified["choices"][0]["message"])  # shallow copy
-                    rc = str(reasoning_content).replace("\r\n", "\n")
-                    original = msg.get("content") or ""
-                    SEP = "\n\n---\n\n"
-                    if original:
-                        msg["content"] = "💭 " + rc + SEP + original
-                    else:
-                        msg["content"] = "💭 " + rc
-                    msg.pop("reasoning_content", None)
-                    modified["choices"][0]["message"] = msg
-                    data = modified
-            yield json.dumps(data)
+            if _called_pruned_tool(_tool_call_names(data), body, full_tools):
+                retry_body = dict(body, tools=full_tools)
+            else:
+                if isinstance(data, dict):
+                    # Same stages as streaming; SSE-only output (thinking events) is discarded
+                    for stage in _build_stream_stages(mode):
+                        stage.on_chunk(data, [])
+                yield json.dumps(data)
+                _log_pruning_outcome(body, full_tools, resent=False)
+
+    if retry_body is not None:
+        _log_pruning_outcome(body, full_tools, resent=True)
+        if pipeline is not None:
+            pipeline.resume()
+        yield from _stream_chat_completion(
+            upstream_url, retry_body, mode=mode, coalesce_ms=coalesce_ms, is_retry=True, pipeline=pipeline
+        )
 
 
 def _increment_streams():
-    global active_streams
-    active_streams += 1
-    print(f"🔒 [STREAM-TRACKING] Stream started (active: {active_streams})")
+    with active_streams.get_lock():
+        active_streams.value += 1
+        active = active_streams.value
+    print(f"🔒 [STREAM-TRACKING] Stream started (active: {active})")
 
 
 def _decrement_streams(reason: str):
-    global active_streams
-    active_streams -= 1
-    print(f"🔓 [STREAM-TRACKING] Stream ended: {reason} (active: {active_streams})")
-    if active_streams == 0:
+    with active_streams.get_lock():
+        active_streams.value -= 1
+        active = active_streams.value
+    print(f"🔓 [STREAM-TRACKING] Stream ended: {reason} (active: {active})")
+    if active == 0:
         # Slight delay then process queued /api/show
         threading.Timer(0.1, process_queued_show_requests).start()
 
 
-def _prepare_chat_body_and_log(body: Dict[str, Any]) -> Dict[str, Any]:
+def _prepare_chat_body_and_log(body: Dict[str, Any], mode: Optional[str] = None) -> Dict[str, Any]:
     if THINKING_DEBUG:
-        print("🧠 [THINKING] Mode:", THINKING_MODE)
+        print("🧠 [THINKING] Mode:", mode or THINKING_MODE)
         print("   Available modes:")
         print("   - 'vscode': Standard reasoning_content for VSCode Copilot (default)")
         print("   - 'events': Custom 'event: thinking' SSE events only")
         print("   - 'both': Both standard and custom events")
         print("   - 'show_reasoning': Route thinking to normal content stream (VSCode will display it!)")
+        print("   - 'content': Alias for 'show_reasoning'")
         print("   - 'off': Disable thinking content entirely\n")
         print("   Configure with: THINKING_MODE=show_reasoning THINKING_DEBUG=true python proxy_server.py")
 
@@ -423,6 +1123,13 @@ def api_version():
     return jsonify({"status": "ok", "version": VERSION or "0.0.0"})
 
 
+@app.route("/api/ready", methods=["GET", "HEAD"])
+def api_ready():
+    # Readiness probe: 200 once startup warm-up has finished, 503 while it is still running
+    ready = warmup_done.is_set()
+    return jsonify(dict(warmup_state.copy(), ready=ready)), 200 if ready else 503
+
+
 @app.post("/api/chat")
 def api_chat_compat():
     # Map Ollama-style /api/chat to OpenAI /v1/chat/completions with thinking support
@@ -435,12 +1142,15 @@ def api_chat_compat():
         body["model"] = _resolve_model_id(original)
         if VERBOSE and body["model"] != original:
             print(f"🔁 [/api/chat] Resolved model alias '{original}' -> '{body['model']}'")
-    body = _prepare_chat_body_and_log(body)
+    mode = _resolve_thinking_mode(request.headers.get("X-Thinking-Mode"))
+    body = _prepare_chat_body_and_log(body, mode)
+    full_tools = _prune_tools(body)
+    coalesce_ms = _resolve_coalesce_ms(request.headers.get("X-SSE-Coalesce-Ms"))
     _increment_streams()
 
     upstream_url = f"{UPSTREAM}/v1/chat/completions"
     try:
-        generator = _stream_chat_completion(upstream_url, body)
+        generator = _stream_chat_completion(upstream_url, body, full_tools, mode, coalesce_ms)
 
         def _cleanup_generator(gen):
             try:
@@ -456,7 +1166,7 @@ def api_chat_compat():
         return jsonify({"error": "upstream_connection_error", "message": str(e)}), 502
 
 
-def _oai_models_to_ollama_tags(oai_models: Dict[str, Any]) -> Dict[str, Any]:
+def _oai_models_to_ollama_tags(oai_models: Dict[str, Any], aliases: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
     """Adapt OpenAI-style /v1/models list to Ollama /api/tags shape minimally."""
     models_in = []
     if isinstance(oai_models, dict) and isinstance(oai_models.get("data"), list):
@@ -480,7 +1190,7 @@ def _oai_models_to_ollama_tags(oai_models: Dict[str, Any]) -> Dict[str, Any]:
         except Exception:
             modified_at = datetime.now(timezone.utc).isoformat()
         alias = _friendly_model_name(mid or "unknown")
-        _register_model_alias(alias, mid or "unknown")
+        _register_model_alias(alias, mid or "unknown", aliases)
         entry = {
             "name": alias,
             "model": mid or "unknown",
@@ -500,59 +1210,70 @@ def _oai_models_to_ollama_tags(oai_models: Dict[str, Any]) -> Dict[str, Any]:
     return out
 
 
+def _fetch_model_catalog() -> List[Dict[str, Any]]:
+    """Fetch upstream models, rebuild MODEL_ALIASES and return Ollama tag entries."""
+    if VERBOSE:
+        print(f"🔎 [/api/tags] Fetching upstream models from {UPSTREAM}/v1/models ...")
+    r = upstream_session.get(f"{UPSTREAM}/v1/models", timeout=14400)
+    r.raise_for_status()
+    data = r.json()
+    # Normalize into Ollama tags shape with friendly aliases and consistent capabilities.
+    # Aliases are collected locally and published at the end, so other workers never
+    # see a half-built table through the shared dict
+    aliases: Dict[str, str] = {}
+    models_out: List[Dict[str, Any]] = []
+    if isinstance(data, dict) and isinstance(data.get("models"), list):
+        src_models = data["models"]
+        for e in src_models:
+            if not isinstance(e, dict):
+                continue
+            mid = e.get("id") or e.get("model") or e.get("name")
+            if not isinstance(mid, str):
+                continue
+            alias = _friendly_model_name(mid)
+            _register_model_alias(alias, mid, aliases)
+            modified_at = e.get("modified_at") or e.get("created")
+            try:
+                if isinstance(modified_at, (int, float)):
+                    modified_at = datetime.fromtimestamp(modified_at, tz=timezone.utc).isoformat()
+                elif not isinstance(modified_at, str):
+                    modified_at = datetime.now(timezone.utc).isoformat()
+            except Exception:
+                modified_at = datetime.now(timezone.utc).isoformat()
+            details = e.get("details") or {}
+            entry = {
+                "name": alias,
+                "model": mid,
+                "modified_at": modified_at,
+                "size": e.get("size", 0),
+                "digest": e.get("digest", ""),
+                "details": {
+                    "parent_model": details.get("parent_model", ""),
+                    "format": details.get("format", "gguf"),
+                    "family": details.get("family", ""),
+                    "families": details.get("families", []),
+                    "parameter_size": details.get("parameter_size", ""),
+                    "quantization_level": details.get("quantization_level", ""),
+                },
+            }
+            caps = set(e.get("capabilities") or [])
+            caps.update(["completion", "chat", "embeddings", "tools", "planAndExecute"])  # inject
+            entry["capabilities"] = sorted(caps)
+            models_out.append(entry)
+    else:
+        adapted = _oai_models_to_ollama_tags(data, aliases)
+        models_out = adapted.get("models", [])
+    MODEL_ALIASES.update(aliases)
+    for stale in set(MODEL_ALIASES.keys()) - set(aliases):
+        MODEL_ALIASES.pop(stale, None)
+    return models_out
+
+
 @app.get("/api/tags")
 def api_tags():
     # List local models; if upstream is llama.cpp (OpenAI), adapt /v1/models
     try:
-        if VERBOSE:
-            print(f"🔎 [/api/tags] Fetching upstream models from {UPSTREAM}/v1/models ...")
-    r = requests.get(f"{UPSTREAM}/v1/models", timeout=14400)
-        r.raise_for_status()
-        data = r.json()
-        # Normalize into Ollama tags shape with friendly aliases and consistent capabilities
-        MODEL_ALIASES.clear()
-        models_out: List[Dict[str, Any]] = []
-        if isinstance(data, dict) and isinstance(data.get("models"), list):
-            src_models = data["models"]
-            for e in src_models:
-                if not isinstance(e, dict):
-                    continue
-                mid = e.get("id") or e.get("model") or e.get("name")
-                if not isinstance(mid, str):
-                    continue
-                alias = _friendly_model_name(mid)
-                _register_model_alias(alias, mid)
-                modified_at = e.get("modified_at") or e.get("created")
-                try:
-                    if isinstance(modified_at, (int, float)):
-                        modified_at = datetime.fromtimestamp(modified_at, tz=timezone.utc).isoformat()
-                    elif not isinstance(modified_at, str):
-                        modified_at = datetime.now(timezone.utc).isoformat()
-                except Exception:
-                    modified_at = datetime.now(timezone.utc).isoformat()
-                details = e.get("details") or {}
-                entry = {
-                    "name": alias,
-                    "model": mid,
-                    "modified_at": modified_at,
-                    "size": e.get("size", 0),
-                    "digest": e.get("digest", ""),
-                    "details": {
-                        "parent_model": details.get("parent_model", ""),
-                        "format": details.get("format", "gguf"),
-                        "family": details.get("family", ""),
-                        "families": details.get("families", []),
-                        "parameter_size": details.get("parameter_size", ""),
-                        "quantization_level": details.get("quantization_level", ""),
-                    },
-                }
-                caps = set(e.get("capabilities") or [])
-                caps.update(["completion", "chat", "embeddings", "tools", "planAndExecute"])  # inject
-                entry["capabilities"] = sorted(caps)
-                models_out.append(entry)
-        else:
-            adapted = _oai_models_to_ollama_tags(data)
-            models_out = adapted.get("models", [])
+        models_out = _fetch_model_catalog()
         count = len(models_out)
         if VERBOSE:
             print(f"🔎 [/api/tags] Normalized models (models={count}) with aliases; capabilities injected")
@@ -563,6 +1284,44 @@ def api_tags():
         return jsonify({"models": []}), 200
 
 
+def _fetch_show_info(model: str) -> Optional[Dict[str, Any]]:
+    """Minimal Ollama-like /api/show payload from /v1/models/{model}, cached per model."""
+    cached = SHOW_CACHE.get(model)
+    if cached is not None:
+        return cached
+    if VERBOSE:
+        print(f"🔎 [/api/show] Request for model='{model}' -> querying {UPSTREAM}/v1/models/{model}")
+    # URL-encode model id in case it contains slashes or spaces
+    try:
+        from requests.utils import quote
+        model_enc = quote(model, safe="")
+    except Exception:
+        model_enc = model
+    r = upstream_session.get(f"{UPSTREAM}/v1/models/{model_enc}", timeout=14400)
+    if r.status_code != 200:
+        return None
+    info = r.json()
+    # Provide a minimal Ollama-like show payload
+    resp = {
+        "modelfile": "",
+        "parameters": "",
+        "template": "",
+        "details": {
+            "parent_model": "",
+            "format": "gguf",
+            "family": info.get("owned_by", ""),
+            "families": [info.get("owned_by")] if info.get("owned_by") else [],
+            "parameter_size": "",
+            "quantization_level": ""
+        },
+        "model_info": {},
+        # Keep capabilities consistent with /api/tags for selection in Ask/Agent
+        "capabilities": ["completion", "chat", "embeddings", "tools", "planAndExecute"],
+    }
+    SHOW_CACHE[model] = resp
+    return resp
+
+
 @app.post("/api/show")
 def api_show():
     # Show model information; map to /v1/models/{model} when Ollama endpoint is unavailable
@@ -572,34 +1331,8 @@ def api_show():
         return jsonify({"error": "bad_request", "message": "Missing 'model' in body"}), 400
     # Try llama.cpp OpenAI-compatible endpoint
     try:
-        if VERBOSE:
-            print(f"🔎 [/api/show] Request for model='{model}' -> querying {UPSTREAM}/v1/models/{model}")
-        # URL-encode model id in case it contains slashes or spaces
-        try:
-            from requests.utils import quote
-            model_enc = quote(model, safe="")
-        except Exception:
-            model_enc = model
-    r = requests.get(f"{UPSTREAM}/v1/models/{model_enc}", timeout=14400)
-        if r.status_code == 200:
-            info = r.json()
-            # Provide a minimal Ollama-like show payload
-            resp = {
-                "modelfile": "",
-                "parameters": "",
-                "template": "",
-                "details": {
-                    "parent_model": "",
-                    "format": "gguf",
-                    "family": info.get("owned_by", ""),
-                    "families": [info.get("owned_by")] if info.get("owned_by") else [],
-                    "parameter_size": "",
-                    "quantization_level": ""
-                },
-                "model_info": {},
-                # Keep capabilities consistent with /api/tags for selection in Ask/Agent
-                "capabilities": ["completion", "chat", "embeddings", "tools", "planAndExecute"],
-            }
+        resp = _fetch_show_info(model)
+        if resp is not None:
             if VERBOSE:
                 print("🔎 [/api/show] Returning minimal Ollama-like info with capabilities",
                       resp.get("capabilities"))
@@ -611,7 +1344,7 @@ def api_show():
     try:
         if VERBOSE:
             print(f"🔎 [/api/show] Falling back to upstream {UPSTREAM}/api/show")
-    r2 = requests.post(f"{UPSTREAM}/api/show", json={"model": model}, timeout=14400)
+        r2 = upstream_session.post(f"{UPSTREAM}/api/show", json={"model": model}, timeout=14400)
         if r2.status_code == 200:
             # Try to inject capabilities into fallback JSON
             try:
@@ -649,7 +1382,7 @@ def api_embed():
                 "input_type": type((body or {}).get("input")).__name__ if isinstance(body, dict) else None,
             }
             print("🔎 [/api/embed] Proxying to /v1/embeddings with shape:", shape)
-    r = requests.post(f"{UPSTREAM}/v1/embeddings", json=body, timeout=14400)
+        r = upstream_session.post(f"{UPSTREAM}/v1/embeddings", json=body, timeout=14400)
         # Try to convert OpenAI response to Ollama shape for better client compatibility
         try:
             obj = r.json()
@@ -689,12 +1422,15 @@ def chat_completions():
         print("[POST] Headers:", dict(request.headers))
     body = request.get_json(silent=True) or {}
 
-    body = _prepare_chat_body_and_log(body)
+    mode = _resolve_thinking_mode(request.headers.get("X-Thinking-Mode"))
+    body = _prepare_chat_body_and_log(body, mode)
+    full_tools = _prune_tools(body)
+    coalesce_ms = _resolve_coalesce_ms(request.headers.get("X-SSE-Coalesce-Ms"))
     _increment_streams()
 
     upstream_url = f"{UPSTREAM}{request.path}"
     try:
-        generator = _stream_chat_completion(upstream_url, body)
+        generator = _stream_chat_completion(upstream_url, body, full_tools, mode, coalesce_ms)
 
         def _cleanup_generator(gen):
             try:
@@ -716,51 +1452,300 @@ def debug_json():
     return jsonify({"minified": json.dumps(body)})
 
 
-# Generic pass-through proxy as a last resort (minimalist)
-@app.route("/", defaults={"path": ""}, methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
-@app.route("/<path:path>", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
-def fallback_proxy(path: str):
-    target_url = f"{UPSTREAM}/{path}"
-    print(f"🚨 [{request.method}] FALLBACK proxy for /{path} -> {target_url}")
+# Generic pass-through proxy as a last resort (zero-buffer)
+#
+# Request bodies are relayed upstream as they arrive and responses are relayed
+# as bytes become readable, without re-encoding. Only JSON bodies sent to paths
+# that can carry tool definitions are read fully and parsed, for tool patching.
+FALLBACK_CHUNK_SIZE = int(os.environ.get("FALLBACK_CHUNK_SIZE", "65536"))
+FALLBACK_TOOL_PATH_SUFFIXES = ("chat/completions", "messages", "responses", "apply-template")
+_HOP_BY_HOP = {"host", "content-length", "transfer-encoding", "connection", "keep-alive", "upgrade"}
+
+
+class _RequestBodyStream:
+    """Iterable request body that relays the client upload as it arrives.
+    A known length keeps Content-Length upstream; otherwise requests sends it chunked.
+    """
+
+    __slots__ = ("stream", "length")
+
+    def __init__(self, stream, length: int):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
 
-    headers = {k: v for k, v in request.headers.items() if k.lower() not in {"host", "content-length"}}
-    data = None
-    json_body = None
-    if request.is_json:
+    def __iter__(self):
+        read = self.stream.read
+        while True:
+            chunk = read(FALLBACK_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _fallback_request_body(path: str):
+    """Pick the upstream request body: patched JSON for tool-bearing requests,
+    otherwise a pass-through stream of the client body (or None when empty)."""
+    if request.is_json and path.endswith(FALLBACK_TOOL_PATH_SUFFIXES):
+        raw = request.get_data()
+        if b'"tools"' not in raw:
+            return raw
         body = request.get_json(silent=True)
         if isinstance(body, dict) and isinstance(body.get("tools"), list):
             if VERBOSE:
                 print("🚨 FALLBACK detected tools - MINIFYING & PATCHING!")
             body["tools"] = patch_tools_array(body["tools"])  # patch tool parameters
-        json_body = body
-    else:
-        data = request.get_data()
+            return json.dumps(body, separators=(",", ":")).encode("utf-8")
+        return raw
+    length = request.content_length
+    if length:
+        return _RequestBodyStream(request.stream, length)
+    if length is None and request.headers.get("Transfer-Encoding", "").lower() == "chunked":
+        return iter(_RequestBodyStream(request.stream, 0))
+    return None
+
+
+def _relay_upstream(resp):
+    """Yield upstream response bytes as soon as they are readable (up to
+    FALLBACK_CHUNK_SIZE per read), still compressed if the upstream compressed them."""
+    try:
+        yield from _read_available(resp, FALLBACK_CHUNK_SIZE, decode_content=False)
+    finally:
+        resp.close()
+
+
+@app.route("/", defaults={"path": ""}, methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+@app.route("/<path:path>", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+def fallback_proxy(path: str):
+    target_url = f"{UPSTREAM}/{path}"
+    if request.query_string:
+        target_url += "?" + request.query_string.decode("latin-1")
+    print(f"🚨 [{request.method}] FALLBACK proxy for /{path} -> {target_url}")
 
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in _HOP_BY_HOP}
+    # Bodies are relayed undecoded: don't let the session's default gzip/deflate ask for
+    # a compressed response the client never requested
+    headers.setdefault("Accept-Encoding", "identity")
     try:
-        resp = requests.request(
+        resp = upstream_session.request(
             request.method,
             target_url,
             headers=headers,
-            json=json_body,
-            data=data if json_body is None else None,
+            data=_fallback_request_body(path),
             stream=True,
             timeout=14400,
         )
-
-        def generate():
-            for chunk in resp.iter_content(chunk_size=8192):
-                if chunk:
-                    yield chunk
-
-        # Build response
-        excluded = {"content-encoding", "transfer-encoding", "content-length", "connection"}
-        response_headers = [(k, v) for k, v in resp.headers.items() if k.lower() not in excluded]
-        return Response(generate(), status=resp.status_code, headers=response_headers)
     except Exception as e:
         if VERBOSE:
             print("🚨 FALLBACK upstream request error:", e)
         return jsonify({"error": "upstream_connection_error", "message": str(e)}), 502
 
+    try:
+        # Bytes are relayed undecoded, so Content-Encoding/Content-Length stay valid
+        excluded = _HOP_BY_HOP - {"content-length"}
+        response_headers = [(k, v) for k, v in resp.headers.items() if k.lower() not in excluded]
+        out = Response(_relay_upstream(resp), status=resp.status_code, headers=response_headers, direct_passthrough=True)
+        # Release the pooled connection even if the client aborts before the body is iterated
+        out.call_on_close(resp.close)
+        return out
+    except Exception:
+        resp.close()
+        raise
+
+
+# --- Startup warm-up ---
+
+def _warmup_step(name: str, **info):
+    # Reassign rather than mutate in place so shared (manager) dicts see the update
+    steps = dict(warmup_state["steps"])
+    steps[name] = dict(info, at=datetime.now(timezone.utc).isoformat())
+    warmup_state["steps"] = steps
+    print(f"🔥 [WARMUP] {name}: {info.get('status')}" + (f" ({info['detail']})" if info.get("detail") else ""))
+
+
+def _warmup_connections():
+    # Open keep-alive connections concurrently so they sit in the pool; returns how many succeeded
+    opened: List[bool] = []
+
+    def _touch():
+        try:
+            upstream_session.get(f"{UPSTREAM}/health", timeout=10).close()
+            opened.append(True)
+        except Exception as e:
+            vlog("[WARMUP] connection warm-up failed:", e)
+
+    threads = [threading.Thread(target=_touch, daemon=True) for _ in range(max(0, min(WARMUP_CONNECTIONS, UPSTREAM_POOL_SIZE)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(opened)
+
+
+def _warmup_model(model: str):
+    # Tiny non-streaming completion so llama-server loads weights and warms its KV cache
+    payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": WARMUP_PROMPT}],
+        "max_tokens": WARMUP_MAX_TOKENS,
+        "stream": False,
+    }
+    start = time.time()
+    r = upstream_session.post(f"{UPSTREAM}/v1/chat/completions", json=payload, timeout=WARMUP_TIMEOUT)
+    r.raise_for_status()
+    return int((time.time() - start) * 1000)
+
+
+def run_warmup(connections: bool = True):
+    """Prefetch the model catalog and show data, pre-open pooled upstream
+    connections and optionally send WARMUP_PROMPT to each model. Retries until
+    the upstream answers; progress is reported by /api/ready.
+    """
+    warmup_state["status"] = "running"
+    warmup_state["started_at"] = datetime.now(timezone.utc).isoformat()
+    while True:
+        try:
+            if connections:
+                opened = _warmup_connections()
+                _warmup_step("connections", status="ok" if opened else "error", detail=f"{opened} opened")
+            models = _fetch_model_catalog()
+            _warmup_step("catalog", status="ok", detail=f"{len(models)} models, {len(MODEL_ALIASES)} aliases")
+            break
+        except Exception as e:
+            _warmup_step("catalog", status="retrying", detail=str(e))
+            time.sleep(WARMUP_RETRY_INTERVAL)
+
+    for entry in models:
+        mid = entry.get("model")
+        try:
+            _fetch_show_info(mid)
+        except Exception as e:
+            vlog(f"[WARMUP] show prefetch failed for {mid}:", e)
+        if WARMUP_PROMPT:
+            try:
+                ms = _warmup_model(mid)
+                _warmup_step(f"model:{entry.get('name')}", status="ok", detail=f"{ms}ms")
+            except Exception as e:
+                _warmup_step(f"model:{entry.get('name')}", status="error", detail=str(e))
+    _warmup_step("show", status="ok", detail=f"{len(SHOW_CACHE)} cached")
+
+    warmup_state["status"] = "ready"
+    warmup_state["finished_at"] = datetime.now(timezone.utc).isoformat()
+    warmup_done.set()
+
+
+def start_warmup():
+    if WARMUP == "off":
+        warmup_state["status"] = "disabled"
+        warmup_done.set()
+        return
+    threading.Thread(target=run_warmup, name="warmup", daemon=True).start()
+    if WARMUP == "blocking":
+        print(f"🔥 [WARMUP] Waiting up to {WARMUP_TIMEOUT:.0f}s for warm-up before serving...")
+        if not warmup_done.wait(WARMUP_TIMEOUT):
+            print("🔥 [WARMUP] Timed out; serving now, warm-up continues in the background")
+
+
+# --- Pre-forked multi-worker serving ---
+
+def _share_state(manager) -> None:
+    """Move process-global state into a multiprocessing manager so that all
+    pre-forked workers read and update the same alias table, show cache and
+    warm-up progress. Must run before forking. TOOL_EMBED_CACHE stays per
+    process: it is only a cache, and proxying each vector lookup over IPC
+    would cost more than the embeddings it saves.
+    """
+    global MODEL_ALIASES, SHOW_CACHE, warmup_state, warmup_done
+    MODEL_ALIASES = manager.dict(MODEL_ALIASES)
+    SHOW_CACHE = manager.dict(SHOW_CACHE)
+    warmup_state = manager.dict(warmup_state)
+    warmup_done = manager.Event()
+
+
+def _run_worker(listen_fd: int) -> None:
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if WARMUP != "off":
+        # Pooled connections are per process, so each worker opens its own
+        threading.Thread(target=_warmup_connections, name="warmup-connections", daemon=True).start()
+    server = make_server(LISTEN_HOST, LISTEN_PORT, app, threaded=True, fd=listen_fd)
+    print(f"👷 [WORKERS] Worker {os.getpid()} serving")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_prefork(workers: int) -> None:
+    """Serve with `workers` pre-forked processes sharing one listening socket.
+
+    Each worker runs the threaded WSGI server, so JSON re-serialization for
+    concurrent streams is spread across interpreters instead of one GIL.
+    Shared state lives in a manager process (see _share_state); warm-up runs in
+    its own process so no threads exist in the parent when it forks.
+    """
+    manager = _mp.Manager()
+    _share_state(manager)
+
+    if WARMUP == "off":
+        warmup_state["status"] = "disabled"
+        warmup_done.set()
+    else:
+        _mp.Process(target=run_warmup, kwargs={"connections": False}, name="warmup", daemon=True).start()
+        if WARMUP == "blocking":
+            print(f"🔥 [WARMUP] Waiting up to {WARMUP_TIMEOUT:.0f}s for warm-up before serving...")
+            if not warmup_done.wait(WARMUP_TIMEOUT):
+                print("🔥 [WARMUP] Timed out; serving now, warm-up continues in the background")
+
+    family = socket.AF_INET6 if ":" in LISTEN_HOST else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((LISTEN_HOST, LISTEN_PORT))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def _spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(sock.fileno())
+            finally:
+                os._exit(0)
+        children[pid] = pid
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, _stop)
+    print(f"👷 [WORKERS] Starting {workers} workers (parent PID: {os.getpid()})")
+    for _ in range(workers):
+        _spawn()
+    try:
+        while True:
+            pid, status = os.wait()
+            if pid in children:
+                del children[pid]
+                if not stopping:
+                    print(f"👷 [WORKERS] Worker {pid} exited (status {status}); restarting")
+                    _spawn()
+    except KeyboardInterrupt:
+        _stop(signal.SIGINT, None)
+    finally:
+        manager.shutdown()
+
 
 def _print_banner():
     startup_time = datetime.now(timezone.utc).isoformat()
@@ -772,6 +1757,8 @@ def _print_banner():
     print("===========================================\n")
     print(f"Proxy listening on http://{LISTEN_HOST}:{LISTEN_PORT} (all interfaces if 0.0.0.0)")
     print(f"Upstream target: {UPSTREAM}")
+    print(f"Workers: {WORKERS} ({'pre-forked' if WORKERS > 1 else 'single process, threaded'})")
+    print(f"Warm-up: {WARMUP}" + (f" (prompt: {WARMUP_PROMPT!r})" if WARMUP_PROMPT else "") + " — readiness at /api/ready")
     print("🧠 Thinking Mode Configuration:")
     print(f"   Mode: {THINKING_MODE}")
     print(f"   Debug: {'enabled' if THINKING_DEBUG else 'disabled'}")
@@ -780,11 +1767,19 @@ def _print_banner():
     print("   - 'events': Custom 'event: thinking' SSE events only")
     print("   - 'both': Both standard and custom events")
     print("   - 'show_reasoning': Route thinking to normal content stream (VSCode will display it!)")
+    print("   - 'content': Alias for 'show_reasoning'")
     print("   - 'off': Disable thinking content entirely")
     print("\n   Configure with: THINKING_MODE=show_reasoning THINKING_DEBUG=true python proxy_server.py")
+    print("   Override per request with the 'X-Thinking-Mode' header")
 
 
 if __name__ == "__main__":
     _print_banner()
-    # threaded=True to allow background timer and queued processing
-    app.run(host=LISTEN_HOST, port=LISTEN_PORT, threaded=True)
+    if WORKERS > 1 and hasattr(os, "fork"):
+        serve_prefork(WORKERS)
+    else:
+        if WORKERS > 1:
+            print("👷 [WORKERS] os.fork is unavailable on this platform; serving from a single process")
+        start_warmup()
+        # threaded=True to allow background timer and queued processing
+        app.run(host=LISTEN_HOST, port=LISTEN_PORT, threaded=True)